@@ -1,8 +1,16 @@
 import streamlit as st
+import re
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
-from datetime import datetime, date
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from datetime import date
 import plotly.graph_objects as go
+from streamlit.errors import StreamlitAPIException
 from streamlit_lottie import st_lottie
 
 # -------------------------
@@ -10,18 +18,51 @@ from streamlit_lottie import st_lottie
 # -------------------------
 import os
 
-API_KEY = st.secrets["weatherapi"]["key"]
+try:
+    API_KEY = st.secrets["weatherapi"]["key"]
+except (KeyError, FileNotFoundError, StreamlitAPIException):
+    # No secrets.toml, or no [weatherapi] key in it
+    API_KEY = None
 if not API_KEY:
     st.error("API key not found! Please check secrets.toml")
+    st.stop()
+
+# -------------------------
+# Worker threads
+# -------------------------
+def thread_pool(max_workers):
+    # Attach the script run context so workers can use st.cache_* like the main thread
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=add_script_run_ctx,
+                              initargs=(None, get_script_run_ctx()))
+
+# -------------------------
+# Shared HTTP session (pooled connections across threads)
+# -------------------------
+HTTP_TIMEOUT = (2.0, 5.0)  # (connect, read) seconds
+
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32,
+                          max_retries=Retry(total=3, backoff_factor=0.25,
+                                            status_forcelist=[502, 503, 504],
+                                            allowed_methods=["GET"],
+                                            raise_on_status=False))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 # -------------------------
 # Load Lottie animation
 # -------------------------
 def load_lottie(url):
-    r = requests.get(url)
-    if r.status_code != 200:
+    try:
+        r = get_http_session().get(url, timeout=HTTP_TIMEOUT)
+        if r.status_code != 200:
+            return None
+        return orjson.loads(r.content)
+    except (requests.RequestException, orjson.JSONDecodeError):
         return None
-    return r.json()
 
 WEATHER_LOTTIE = {
     "Sunny": "https://assets3.lottiefiles.com/packages/lf20_sun.json",
@@ -34,29 +75,58 @@ WEATHER_LOTTIE = {
     "Mist": "https://assets3.lottiefiles.com/packages/lf20_fog.json",
 }
 
+_LOTTIE_URL_BY_KEY = {key.lower(): url for key, url in WEATHER_LOTTIE.items()}
+_LOTTIE_PATTERN = re.compile("|".join(re.escape(key) for key in _LOTTIE_URL_BY_KEY))
+
+@st.cache_resource(ttl=86400, show_spinner=False)
+def preload_lotties():
+    urls = list(set(WEATHER_LOTTIE.values()))
+    with thread_pool(8) as ex:
+        lotties = dict(zip(urls, ex.map(load_lottie, urls)))
+    # Failed downloads are left out so a later lookup retries them
+    return {url: data for url, data in lotties.items() if data is not None}
+
+def get_lottie(url):
+    lotties = preload_lotties()
+    if url not in lotties:
+        data = load_lottie(url)
+        if data is None:
+            return None
+        lotties[url] = data
+    return lotties[url]
+
 def get_lottie_for_condition(condition):
-    for key in WEATHER_LOTTIE.keys():
-        if key.lower() in condition.lower():
-            return load_lottie(WEATHER_LOTTIE[key])
-    return None
-
-# -------------------------
-# Full-page animated background
-# -------------------------
-def set_full_bg_animation(condition, width, height):
-    url = None
-    if "sun" in condition.lower() or "clear" in condition.lower():
-        url = "https://assets3.lottiefiles.com/packages/lf20_sun.json"
-    elif "cloud" in condition.lower():
-        url = "https://assets5.lottiefiles.com/packages/lf20_cloudy.json"
-    elif "rain" in condition.lower() or "thunder" in condition.lower():
-        url = "https://assets3.lottiefiles.com/packages/lf20_rain.json"
-    elif "snow" in condition.lower():
-        url = "https://assets3.lottiefiles.com/packages/lf20_snow.json"
-    if url:
-        lottie_bg = load_lottie(url)
-        if lottie_bg:
-            st_lottie(lottie_bg, height=height, width=width, key=f"bg_{condition}")
+    match = _LOTTIE_PATTERN.search(condition.lower())
+    if match is None:
+        return None
+    return get_lottie(_LOTTIE_URL_BY_KEY[match.group(0)])
+
+# -------------------------
+# Full-page background
+# -------------------------
+_BG_GRADIENTS = {
+    "sun": "linear-gradient(135deg,#ffd54f,#ffb300)",
+    "cloud": "linear-gradient(135deg,#b0bec5,#78909c)",
+    "rain": "linear-gradient(135deg,#4fc3f7,#0277bd)",
+    "snow": "linear-gradient(135deg,#e0f7fa,#b2ebf2)",
+}
+
+_BG_KEYWORDS = (
+    ("sun", frozenset({"sun", "sunny", "clear"})),
+    ("cloud", frozenset({"cloud", "cloudy"})),
+    ("rain", frozenset({"rain", "thunder", "thundery"})),
+    ("snow", frozenset({"snow"})),
+)
+
+def set_full_bg(condition):
+    tokens = set(condition.lower().split())
+    grad = None
+    for tag, keywords in _BG_KEYWORDS:
+        if tokens & keywords:
+            grad = _BG_GRADIENTS[tag]
+            break
+    if grad:
+        st.markdown(f"<style>.stApp{{background:{grad};}}</style>", unsafe_allow_html=True)
 
 # -------------------------
 # Overlay CSS
@@ -79,29 +149,49 @@ def set_overlay_css():
 # -------------------------
 # Get weather data from WeatherAPI
 # -------------------------
+@st.cache_data(ttl=600, show_spinner=False)
 def get_weather(city):
     url = f"http://api.weatherapi.com/v1/forecast.json?key={API_KEY}&q={city}&days=7&aqi=no&alerts=no"
-    response = requests.get(url).json()
+    response = orjson.loads(get_http_session().get(url, timeout=HTTP_TIMEOUT).content)
     if response.get("error"):
         return None
     current = response["current"]
     location = response["location"]
-    forecast_days = response["forecast"]["forecastday"]
-    forecast = []
-    for day in forecast_days:
-        forecast.append({
-            "date": datetime.strptime(day["date"], "%Y-%m-%d"),
-            "temp_day": day["day"]["maxtemp_c"],
-            "temp_night": day["day"]["mintemp_c"],
-            "weather": day["day"]["condition"]["text"],
-            "wind_kph": day["day"]["maxwind_kph"],
-            "humidity": day["day"]["avghumidity"],
-            "chance_of_rain": day["day"]["daily_chance_of_rain"],
-            "uv": day["day"]["uv"],
-            "sunrise": day["astro"]["sunrise"],
-            "sunset": day["astro"]["sunset"],
-            "icon": "http:" + day["day"]["condition"]["icon"]
-        })
+    days = response["forecast"]["forecastday"]
+    day_blocks = [d["day"] for d in days]
+    astro_blocks = [d["astro"] for d in days]
+    dates = [d["date"] for d in days]
+    forecast_cols = {
+        "temp_day": [b["maxtemp_c"] for b in day_blocks],
+        "temp_night": [b["mintemp_c"] for b in day_blocks],
+        "weather": [b["condition"]["text"] for b in day_blocks],
+        "wind_kph": [b["maxwind_kph"] for b in day_blocks],
+        "humidity": [b["avghumidity"] for b in day_blocks],
+        "chance_of_rain": [b["daily_chance_of_rain"] for b in day_blocks],
+        "uv": [b["uv"] for b in day_blocks],
+        "sunrise": [a["sunrise"] for a in astro_blocks],
+        "sunset": [a["sunset"] for a in astro_blocks],
+        "icon": ["http:" + b["condition"]["icon"] for b in day_blocks],
+    }
+    forecast_df = pd.DataFrame({
+        "date": np.array(dates, dtype="datetime64[D]"),
+        "temp_day": np.asarray(forecast_cols["temp_day"], dtype=np.float32),
+        "temp_night": np.asarray(forecast_cols["temp_night"], dtype=np.float32),
+        "weather": pd.array(forecast_cols["weather"], dtype="category"),
+        "wind_kph": np.asarray(forecast_cols["wind_kph"], dtype=np.float32),
+        "humidity": np.asarray(forecast_cols["humidity"], dtype=np.int8),
+        "chance_of_rain": np.asarray(forecast_cols["chance_of_rain"], dtype=np.int8),
+        "uv": np.asarray(forecast_cols["uv"], dtype=np.float32),
+        "sunrise": forecast_cols["sunrise"],
+        "sunset": forecast_cols["sunset"],
+        "icon": forecast_cols["icon"],
+    })
+    forecast_dates = [date.fromisoformat(d) for d in dates]
+    temp_day = forecast_df["temp_day"].to_numpy()
+    alerts_hot = temp_day > 35
+    alerts_cold = temp_day < 10
+    alerts_uv = forecast_df["uv"].to_numpy() >= 7
+    alerts_rain = forecast_df["chance_of_rain"].to_numpy() >= 50
     data = {
         "city": location["name"],
         "region": location["region"],
@@ -111,13 +201,51 @@ def get_weather(city):
         "weather": current["condition"]["text"],
         "wind_kph": current["wind_kph"],
         "wind_dir": current["wind_dir"],
-        "sunrise": forecast[0]["sunrise"],
-        "sunset": forecast[0]["sunset"],
+        "sunrise": forecast_cols["sunrise"][0],
+        "sunset": forecast_cols["sunset"][0],
         "icon": "http:" + current["condition"]["icon"],
-        "forecast": forecast
+        "forecast_cols": forecast_cols,
+        "forecast_by_date": {d: i for i, d in enumerate(forecast_dates)},
+        "forecast_df": forecast_df,
+        "alerts": dict(zip(forecast_dates, zip(alerts_hot, alerts_cold, alerts_uv, alerts_rain)))
     }
     return data
 
+# Transport and decode errors propagate out of get_weather so st.cache_data
+# doesn't store them; the prefetch returns them in place of the data.
+def fetch_weather(city):
+    try:
+        return get_weather(city)
+    except (requests.RequestException, orjson.JSONDecodeError) as exc:
+        return exc
+
+# -------------------------
+# Comparison chart
+# -------------------------
+# cache_resource hands back the same object; the figure is never mutated after caching
+@st.cache_resource(show_spinner=False, max_entries=32)
+def build_comparison_fig(df: pd.DataFrame, width: int) -> go.Figure:
+    fig = go.Figure()
+    fig.add_traces([
+        go.Scatter(x=df.index, y=df[col], mode='lines+markers', name=col)
+        for col in df.columns
+    ])
+    fig.update_layout(
+        xaxis_title="Date",
+        yaxis_title="Temperature (°C)",
+        legend_title="Cities",
+        hovermode="x unified",
+        width=width
+    )
+    return fig
+
+# -------------------------
+# CSV export
+# -------------------------
+@st.cache_data(show_spinner=False)
+def df_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode("utf-8")
+
 # -------------------------
 # Streamlit layout
 # -------------------------
@@ -127,33 +255,55 @@ set_overlay_css()
 
 cities_input = st.text_input("Enter cities separated by commas:", "Kathmandu,Lalitpur")
 cities = [c.strip() for c in cities_input.split(",")]
+if st.button("🔄 Refresh"):
+    get_weather.clear()
 
-# Responsive settings
-screen_width = st.sidebar.slider("Screen width for preview (px)", 320, 1600, 800)
-screen_height = st.sidebar.slider("Screen height for preview (px)", 400, 1600, 800)
-is_mobile = screen_width < 700
-
-comparison_df = pd.DataFrame()
-download_df = pd.DataFrame()
-
-# Layout for cities
-if is_mobile:
-    cols = [st.container() for _ in cities]  # vertical stacking
-else:
-    cols = st.columns(len(cities))  # multi-column
+# -------------------------
+# Fetch all cities and animations concurrently
+# -------------------------
+with thread_pool(min(16, len(cities))) as ex:
+    weather_results = list(ex.map(fetch_weather, cities))
+preload_lotties()
 
 # -------------------------
-# Loop through cities
+# City rendering (slider and date changes rerun only this fragment)
 # -------------------------
-for i, city in enumerate(cities):
-    weather = get_weather(city)
-    with cols[i]:
-        if weather:
+@st.fragment
+def render_cities(cities, weather_results):
+    # Responsive settings
+    with st.expander("📐 Preview size"):
+        screen_width = st.slider("Screen width for preview (px)", 320, 1600, 800)
+    is_mobile = screen_width < 700
+
+    comparison_cols = {}
+    download_frames = []
+
+    valid = [w for w in weather_results if isinstance(w, dict)]
+    invalid = [c for c, w in zip(cities, weather_results) if w is None]
+    if invalid:
+        st.warning(f"Not found: {', '.join(invalid)}")
+    failed = [c for c, w in zip(cities, weather_results) if isinstance(w, Exception)]
+    if failed:
+        st.warning(f"Couldn't fetch: {', '.join(failed)}")
+
+    # Layout for cities
+    if is_mobile:
+        cols = [st.container() for _ in valid]  # vertical stacking
+    elif valid:
+        cols = st.columns(len(valid))  # multi-column
+    else:
+        cols = []
+
+    # -------------------------
+    # Loop through cities
+    # -------------------------
+    for col, weather in zip(cols, valid):
+        with col:
             # Full-page background
-            set_full_bg_animation(weather['weather'], screen_width, screen_height)
+            set_full_bg(weather['weather'])
             st.markdown('<div class="overlay">', unsafe_allow_html=True)
             st.subheader(f"{weather['city']}, {weather['country']}")
-            
+
             # Current weather Lottie/icon
             lottie_anim = get_lottie_for_condition(weather['weather'])
             width = min(screen_width//3, 300)
@@ -161,13 +311,13 @@ for i, city in enumerate(cities):
                 st_lottie(lottie_anim, height=150, width=width)
             else:
                 st.image(weather['icon'], width=60)
-            
+
             st.write(f"**{weather['weather']}**")
             st.write(f"🌡 Temperature: {weather['temp']}°C")
             st.write(f"💧 Humidity: {weather['humidity']}%")
             st.write(f"🌬 Wind: {weather['wind_kph']} kph {weather['wind_dir']}")
             st.write(f"🌅 Sunrise: {weather['sunrise']} | 🌇 Sunset: {weather['sunset']}")
-            
+
             # Forecast date selection
             selected_date = st.date_input(
                 f"Select a date for {weather['city']}",
@@ -175,15 +325,16 @@ for i, city in enumerate(cities):
                 min_value=date.today(),
                 max_value=date.today() + pd.Timedelta(days=6)
             )
-            forecast_for_date = next((d for d in weather["forecast"] if d["date"].date() == selected_date), None)
-            if forecast_for_date:
+            day_index = weather["forecast_by_date"].get(selected_date)
+            if day_index is not None:
+                forecast_for_date = {key: values[day_index] for key, values in weather["forecast_cols"].items()}
                 st.markdown(f"**Forecast on {selected_date.strftime('%A, %d %B %Y')}:**")
                 lottie_forecast = get_lottie_for_condition(forecast_for_date['weather'])
                 if lottie_forecast:
                     st_lottie(lottie_forecast, height=120, width=width)
                 else:
                     st.image(forecast_for_date['icon'], width=50)
-                
+
                 st.write(f"🌡 Day Temp: {forecast_for_date['temp_day']}°C")
                 st.write(f"🌡 Night Temp: {forecast_for_date['temp_night']}°C")
                 st.write(f"🌤 Condition: {forecast_for_date['weather']}")
@@ -192,57 +343,56 @@ for i, city in enumerate(cities):
                 st.write(f"🌧 Chance of Rain: {forecast_for_date['chance_of_rain']}%")
                 st.write(f"🌞 UV Index: {forecast_for_date['uv']}")
                 st.write(f"🌅 Sunrise: {forecast_for_date['sunrise']} | 🌇 Sunset: {forecast_for_date['sunset']}")
-                
+
                 # Extreme alerts
-                if forecast_for_date["temp_day"] > 35:
+                is_hot, is_cold, is_high_uv, is_rainy = weather["alerts"][selected_date]
+                if is_hot:
                     st.markdown("⚠️ **Hot day alert!** 🔥")
-                elif forecast_for_date["temp_day"] < 10:
+                elif is_cold:
                     st.markdown("❄️ **Cold day alert!** 🥶")
-                if forecast_for_date["uv"] >= 7:
+                if is_high_uv:
                     st.markdown("⚠️ **High UV Index!** 🌞")
-                if forecast_for_date["chance_of_rain"] >= 50:
+                if is_rainy:
                     st.markdown("💧 **High chance of rain!** 🌧️")
-            
+
             # Add to comparison dataframe
-            temp_df = pd.DataFrame(weather["forecast"])[["date","temp_day","temp_night"]]
-            temp_df = temp_df.set_index("date").rename(
-                columns={"temp_day": f"{weather['city']}_day", "temp_night": f"{weather['city']}_night"})
-            comparison_df = pd.concat([comparison_df, temp_df], axis=1)
-            
+            forecast_df = weather["forecast_df"]
+            dates_index = pd.DatetimeIndex(forecast_df["date"], name="date")
+            comparison_cols[f"{weather['city']}_day"] = pd.Series(forecast_df["temp_day"].values, index=dates_index)
+            comparison_cols[f"{weather['city']}_night"] = pd.Series(forecast_df["temp_night"].values, index=dates_index)
+
             # Add to CSV download dataframe
-            city_csv_df = pd.DataFrame(weather["forecast"])
+            city_csv_df = weather["forecast_df"].copy()
             city_csv_df["city"] = weather["city"]
-            download_df = pd.concat([download_df, city_csv_df], ignore_index=True)
-            
+            download_frames.append(city_csv_df)
+
             st.markdown('</div>', unsafe_allow_html=True)
-        else:
-            st.error(f"City '{city}' not found!")
 
-# -------------------------
-# Plotly temperature comparison chart
-# -------------------------
-if not comparison_df.empty:
-    st.markdown("## 🌡 Temperature Comparison Across Cities")
-    fig = go.Figure()
-    for col in comparison_df.columns:
-        fig.add_trace(go.Scatter(
-            x=comparison_df.index, y=comparison_df[col], mode='lines+markers', name=col
-        ))
-    fig.update_layout(
-        xaxis_title="Date",
-        yaxis_title="Temperature (°C)",
-        legend_title="Cities",
-        hovermode="x unified",
-        width=min(screen_width, 1000)
-    )
-    st.plotly_chart(fig, use_container_width=True)
+    comparison_df = pd.DataFrame(comparison_cols)
+    download_df = pd.concat(download_frames, ignore_index=True) if download_frames else pd.DataFrame()
+    if not download_df.empty:
+        download_df = download_df.astype({
+            "temp_day": "float32", "temp_night": "float32", "wind_kph": "float32", "uv": "float32",
+            "humidity": "int8", "chance_of_rain": "int8",
+            "weather": "category", "city": "category", "icon": "category"
+        })
 
-# -------------------------
-# CSV download
-# -------------------------
-if not download_df.empty:
-    st.markdown("## 📥 Download Forecast Data")
-    st.download_button("Download CSV", download_df.to_csv(index=False), "weather_forecast.csv", "text/csv")
+    # -------------------------
+    # Plotly temperature comparison chart
+    # -------------------------
+    if not comparison_df.empty:
+        st.markdown("## 🌡 Temperature Comparison Across Cities")
+        fig = build_comparison_fig(comparison_df, min(screen_width, 1000))
+        st.plotly_chart(fig, use_container_width=True)
+
+    # -------------------------
+    # CSV download
+    # -------------------------
+    if not download_df.empty:
+        st.markdown("## 📥 Download Forecast Data")
+        st.download_button("Download CSV", df_to_csv_bytes(download_df), "weather_forecast.csv", "text/csv")
+
+render_cities(cities, weather_results)
 
 st.markdown("---")
 st.info("Data provided by [WeatherAPI](https://www.weatherapi.com/)")